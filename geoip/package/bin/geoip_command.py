@@ -1,16 +1,20 @@
 """MaxMind database lookup streaming command for Splunk."""
 
+import logging
 import os
-import re
+import socket
 import sys
-from collections.abc import Iterator
-from ipaddress import ip_network
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from functools import cache, lru_cache, partial
+from ipaddress import IPv6Address, ip_network
 from typing import Any, Protocol
 
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
+_LIB_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "lib"))
+if _LIB_DIR not in sys.path:
+    sys.path.insert(0, _LIB_DIR)
 
 import maxminddb
-from geoip_utils import get_database_directory, get_logger
+from geoip_utils import get_database_path, get_logger
 
 
 class SearchInfo(Protocol):
@@ -31,13 +35,14 @@ class Command(Protocol):
 
     databases: str
     field: str
+    fields: str
     prefix: str
     metadata: Metadata
 
 
 def stream(
     command: Command,
-    events: Iterator[dict[str, Any]],
+    events: Iterable[dict[str, Any]],
 ) -> Iterator[dict[str, Any]]:
     """Enrich events with data from MaxMind databases.
 
@@ -47,7 +52,7 @@ def stream(
     most specific matched CIDR block across all databases.
 
     When multiple databases contain the same field, the last database in the
-    list wins.
+    list wins. When 'fields' is set, only the listed fields are added.
 
     If no result is found in any database (invalid IP, IP not in database, or
     missing IP field), the event is yielded unchanged.
@@ -60,67 +65,236 @@ def stream(
                 (default: 'ip').
             prefix: A prefix to prepend to all output field names
                 (default: '').
-        events: Generator of event dictionaries
+            fields: Comma-separated list of output field names to add,
+                without the prefix (e.g., 'country.iso_code,network').
+                All fields are added when empty (default: '').
+        events: Event dictionaries, in any iterable. They are iterated over
+            once, in order.
 
     Yields:
         Event dictionaries, enriched with database fields when a match is found
 
     """
-    database_names = [name.strip() for name in command.databases.split(",")]
-    readers = [_get_reader(name) for name in database_names]
+    database_names = _parse_database_names(command.databases)
     field = command.field
     prefix = command.prefix
-    session_key = command.metadata.searchinfo.session_key
+    fields = frozenset(
+        f"{prefix}{name.strip()}" for name in command.fields.split(",") if name.strip()
+    )
+    logger = get_logger(command.metadata.searchinfo.session_key)
+    debug_on = logger.isEnabledFor(logging.DEBUG)
+
+    lookup_key = (database_names, prefix, fields)
+    lookup = _lookups.get(lookup_key)
+    if lookup is None:
+        # Each reader's lookup method is bound once here rather than looked
+        # up on the reader for every IP address. The database type is only
+        # used for logging, but is also read once rather than each time an
+        # IP address is not found.
+        readers = [
+            (reader.get_with_prefix_len, reader.metadata().database_type)
+            for reader in (_get_reader(name, logger) for name in database_names)
+        ]
+        lookup = lru_cache(maxsize=_LOOKUP_CACHE_SIZE)(
+            partial(_lookup, readers, prefix, fields, logger),
+        )
+        _lookups[lookup_key] = lookup
 
     for event in events:
         ip_address = event.get(field)
 
         if not ip_address:
-            get_logger(session_key).debug("Event missing or empty field: %s", field)
+            if debug_on:
+                logger.debug("Event missing or empty field: %s", field)
             yield event
             continue
 
-        found_any = False
-        largest_prefix_len = 0
+        items = lookup(ip_address)
+        if items is None:
+            yield event
+            continue
 
-        for reader in readers:
-            try:
-                record, prefix_len = reader.get_with_prefix_len(ip_address)
-            except ValueError:
-                get_logger(session_key).debug("Invalid IP address: %s", ip_address)
-                continue
+        event.update(items)
+        yield event
 
-            if not record:
-                get_logger(session_key).debug(
-                    "No record found for IP %s in database %s",
-                    ip_address,
-                    reader.metadata().database_type,
-                )
-                continue
 
-            if not isinstance(record, dict):
-                get_logger(session_key).debug(
-                    "Record for IP %s is not a dict: %s",
-                    ip_address,
-                    type(record).__name__,
-                )
-                continue
+# Maximum number of distinct IP addresses whose lookup results are cached
+# for each combination of stream() arguments. Each entry holds the output
+# fields for one IP address, which is about 10 KB for a full record from a
+# large database such as GeoIP2-Enterprise, so a full cache holds about
+# 10 MB. Searches over more distinct IP addresses than this mostly miss.
+_LOOKUP_CACHE_SIZE = 1_000
 
-            found_any = True
+# Cached lookup functions, keyed by the (database names, prefix, fields)
+# arguments they were built for.
+#
+# Events commonly repeat the same IP addresses (e.g., busy clients in web
+# server logs). Chunked streaming commands receive many batches of events
+# in the same process, so keeping the cache at module level, rather than
+# per stream() call, lets an IP address seen in an earlier batch skip the
+# database lookup and record flattening. Like _readers, the cache starts
+# empty for each search, so results never outlive the databases they were
+# read from. Since a cached IP address is not looked up again, _lookup's
+# debug messages for it (e.g., "No record found") are only logged the
+# first time it is seen in the search.
+_lookups: dict[
+    tuple[tuple[str, ...], str, frozenset[str]],
+    Callable[[str], tuple[tuple[str, Any], ...] | None],
+] = {}
+
+
+def _lookup(
+    readers: Sequence[tuple[Callable[[str], tuple[Any, int]], str]],
+    prefix: str,
+    fields: frozenset[str],
+    logger: logging.Logger,
+    ip_address: str,
+) -> tuple[tuple[str, Any], ...] | None:
+    """Look up an IP address in each database and build the output fields.
 
-            for key, value in _flatten_record(record):
-                event[f"{prefix}{key}"] = value
+    Args:
+        readers: The (get_with_prefix_len, database_type) pairs for the
+            database readers to query, in order
+        prefix: The prefix to prepend to all output field names
+        fields: The output field names to include, with the prefix applied,
+            or an empty set to include all fields
+        logger: The logger for debug messages
+        ip_address: The IP address to look up
 
-            largest_prefix_len = max(largest_prefix_len, prefix_len)
+    Returns:
+        The (field_name, value) pairs to add to the event, with the prefix
+        already applied and the 'network' field (if included) last, or None
+        if no database has a record for the IP address. Fields from later
+        databases follow those from earlier ones, so assigning them in order
+        lets the last database win.
 
-        if not found_any:
-            yield event
+    """
+    # Rejecting obviously invalid values (e.g., hostnames) up front avoids
+    # having each reader raise and catch a ValueError for them.
+    if not _looks_like_ip(ip_address):
+        logger.debug("Invalid IP address: %s", ip_address)
+        return None
+
+    items: list[tuple[str, Any]] = []
+    # -1 until a record is found, since a matched network may be /0
+    largest_prefix_len = -1
+
+    for get_with_prefix_len, database_type in readers:
+        try:
+            record, prefix_len = get_with_prefix_len(ip_address)
+        except ValueError:
+            logger.debug("Invalid IP address: %s", ip_address)
             continue
 
-        network = ip_network(f"{ip_address}/{largest_prefix_len}", strict=False)
-        event[f"{prefix}network"] = str(network)
+        if not record:
+            logger.debug(
+                "No record found for IP %s in database %s",
+                ip_address,
+                database_type,
+            )
+            continue
 
-        yield event
+        # Skip databases whose records are not maps
+        if type(record) is not dict:
+            logger.debug(
+                "Record for IP %s is not a dict: %s",
+                ip_address,
+                type(record).__name__,
+            )
+            continue
+
+        # Field names are interned so that the cached results for different IP
+        # addresses share one string object per field name rather than each
+        # holding its own copy.
+        items.extend(
+            (sys.intern(key), value)
+            for key, value in _flatten_record(record, prefix)
+            if not fields or key in fields
+        )
+        largest_prefix_len = max(largest_prefix_len, prefix_len)
+
+    if largest_prefix_len < 0:
+        return None
+
+    network_field = f"{prefix}network"
+    if not fields or network_field in fields:
+        network = _format_network(ip_address, largest_prefix_len)
+        items.append((sys.intern(network_field), network))
+    return tuple(items)
+
+
+# The shape of an IPv4 address in dotted-quad notation, as checked by
+# _looks_like_ip
+_IPV4_OCTET_COUNT = 4
+_IPV4_MAX_OCTET_LEN = 3
+_IPV4_MAX_OCTET = 255
+
+
+def _looks_like_ip(ip_address: str) -> bool:
+    """Check whether a value could be an IP address, without parsing it.
+
+    Every IPv6 address contains a ':'. Anything else must be four
+    dot-separated ASCII decimal octets, without leading zeros, to be an
+    IPv4 address. This only rejects values that are certainly invalid; the
+    readers still validate the rest.
+
+    The IPv4 check is meant to accept exactly what ipaddress accepts. Some
+    readers are more lenient (e.g., the C extension accepts zero-padded
+    octets), and _format_network cannot format the network for an address
+    that socket and ipaddress reject, so anything more lenient here would
+    fail the search.
+
+    Args:
+        ip_address: The value of the IP address field
+
+    Returns:
+        False if the value is certainly not an IP address, otherwise True
+
+    """
+    if ":" in ip_address:
+        return True
+    octets = ip_address.split(".")
+    return len(octets) == _IPV4_OCTET_COUNT and all(
+        octet.isascii()
+        and octet.isdigit()
+        and len(octet) <= _IPV4_MAX_OCTET_LEN
+        and (octet == "0" or octet[0] != "0")
+        and int(octet) <= _IPV4_MAX_OCTET
+        for octet in octets
+    )
+
+
+def _format_network(ip_address: str, prefix_len: int) -> str:
+    """Format the CIDR block of the given prefix length containing an IP.
+
+    The address is masked directly on its packed form, which avoids
+    parsing an ipaddress network object for the common case. IPv4 networks
+    are formatted with socket.inet_ntop. IPv6 networks are formatted with
+    ipaddress, since inet_ntop's IPv6 output (e.g., for IPv4-mapped
+    addresses) varies by platform. Addresses that socket cannot parse go
+    through ip_network.
+
+    Args:
+        ip_address: The IP address that was looked up
+        prefix_len: The prefix length of the matched network
+
+    Returns:
+        The network in CIDR notation (e.g., '214.78.120.0/22')
+
+    """
+    if ":" in ip_address:
+        family, bits = socket.AF_INET6, 128
+    else:
+        family, bits = socket.AF_INET, 32
+    try:
+        packed = socket.inet_pton(family, ip_address)
+    except OSError:
+        return str(ip_network(f"{ip_address}/{prefix_len}", strict=False))
+    host_bits = bits - prefix_len
+    network = int.from_bytes(packed) >> host_bits << host_bits
+    if family == socket.AF_INET:
+        return f"{socket.inet_ntop(family, network.to_bytes(4))}/{prefix_len}"
+    return f"{IPv6Address(network)}/{prefix_len}"
 
 
 # Cache of open database readers, keyed by database name.
@@ -135,78 +309,141 @@ def stream(
 # receive multiple batches in the same process).
 _readers: dict[str, maxminddb.Reader] = {}
 
-# Valid database name pattern (alphanumeric, underscores, and hyphens only)
-_VALID_DB_NAME = re.compile(r"^[A-Za-z0-9_-]+$")
+
+@cache
+def _parse_database_names(databases: str) -> tuple[str, ...]:
+    """Parse and validate the comma-separated databases argument.
+
+    Database names may only contain ASCII letters, digits, underscores, and
+    hyphens. This prevents path traversal when the name is used to build
+    the database file path.
+
+    The result is cached since stream() is called with the same argument
+    for every batch of events in a search.
+
+    Args:
+        databases: Comma-separated list of database names
+
+    Returns:
+        The database names, with surrounding whitespace removed
+
+    Raises:
+        ValueError: If a database name contains invalid characters
+
+    """
+    names = tuple(name.strip() for name in databases.split(","))
+    for name in names:
+        if not (name.isascii() and name.replace("-", "").replace("_", "").isalnum()):
+            msg = f"Invalid database name: {name}"
+            raise ValueError(msg)
+    return names
 
 
-def _get_reader(name: str) -> maxminddb.Reader:
+def _get_reader(name: str, logger: logging.Logger) -> maxminddb.Reader:
     """Get a database reader, opening it if not already cached.
 
     Args:
-        name: The database name (e.g., 'GeoIP2-Country')
+        name: The database name (e.g., 'GeoIP2-Country'), already validated
+            by _parse_database_names
+        logger: The logger for a warning if the database is opened without
+            the C extension
 
     Returns:
         The maxminddb.Reader for the database
 
     Raises:
-        ValueError: If the database name contains invalid characters
         FileNotFoundError: If the database file doesn't exist
 
     """
-    if not _VALID_DB_NAME.match(name):
-        msg = f"Invalid database name: {name}"
-        raise ValueError(msg)
     if name not in _readers:
-        db_dir = get_database_directory()
-        db_path = db_dir / f"{name}.mmdb"
-        if not db_path.exists():
+        db_path = get_database_path(name)
+        if not os.path.exists(db_path):
             msg = f"Database not found: {db_path}"
             raise FileNotFoundError(msg)
-        _readers[name] = maxminddb.open_database(str(db_path))
+        _readers[name] = _open_database(db_path, logger)
     return _readers[name]
 
 
-def _flatten_record(record: dict[str, Any]) -> Iterator[tuple[str, Any]]:
-    """Flatten a nested record dict into dot-notation keys.
+def _open_database(db_path: str, logger: logging.Logger) -> maxminddb.Reader:
+    """Open a database with the maxminddb C extension when it is available.
 
-    Args:
-        record: A dictionary that may contain nested dictionaries or lists
+    The C extension walks the search tree and decodes records in C, which
+    is much faster than the pure Python reader. It is only used when the
+    installed maxminddb wheel includes it for this platform, so fall back
+    to the pure Python memory-mapped reader rather than failing the search,
+    and log a warning since lookups will be much slower.
 
-    Yields:
-        Tuples of (flattened_key, value) for all leaf values
+    Args:
+        db_path: Path to the .mmdb file
+        logger: The logger for a warning if the C extension is not available
 
-    Examples:
-        {"country": {"iso_code": "US"}} -> [("country.iso_code", "US")]
-        {"subdivisions": [{"iso_code": "CA"}]} -> [("subdivisions.0.iso_code", "CA")]
+    Returns:
+        The maxminddb.Reader for the database
 
     """
-    for key, value in record.items():
-        yield from _flatten_value(value, key)
-
+    try:
+        return maxminddb.open_database(db_path, maxminddb.MODE_MMAP_EXT)
+    except ValueError:
+        # Raised when the maxminddb.extension module is not available
+        logger.warning(
+            "The maxminddb C extension is not available on this platform. "
+            "Using the slower pure Python reader for %s",
+            db_path,
+        )
+        return maxminddb.open_database(db_path, maxminddb.MODE_MMAP)
+
+
+def _flatten_record(record: dict[str, Any], prefix: str = "") -> list[tuple[str, Any]]:
+    """Flatten a nested record dict into dot-notation keys.
 
-def _flatten_value(
-    value: Any,  # noqa: ANN401
-    key: str,
-) -> Iterator[tuple[str, Any]]:
-    """Flatten a value, recursing into dicts and lists.
+    The record is walked with an explicit stack rather than recursion, and
+    each key is joined from its path segments only once, at the leaf. The
+    prefix is applied to the top-level keys when they are pushed, so it is
+    not concatenated again for every leaf. The pairs are collected into a
+    list rather than yielded, so callers do not pay for resuming a
+    generator for every leaf.
 
     Args:
-        value: The value to flatten (may be dict, list, or scalar)
-        key: The key for this value
+        record: A dictionary that may contain nested dictionaries or lists.
+            Nested values must be plain dicts and lists, as maxminddb decodes
+            them. They are detected with exact type checks, which are
+            cheaper than isinstance, so instances of subclasses are treated
+            as leaf values.
+        prefix: A prefix to prepend to all flattened keys (default: '')
 
-    Yields:
-        Tuples of (flattened_key, value) for all leaf values
+    Returns:
+        Tuples of (flattened_key, value) for all leaf values, in record order
+
+    Examples:
+        {"country": {"iso_code": "US"}} -> [("country.iso_code", "US")]
+        {"subdivisions": [{"iso_code": "CA"}]} -> [("subdivisions.0.iso_code", "CA")]
 
     """
-    if isinstance(value, dict):
-        for sub_key, sub_value in value.items():
-            yield from _flatten_value(sub_value, f"{key}.{sub_key}")
-    elif isinstance(value, list):
-        for i, item in enumerate(value):
-            yield from _flatten_value(item, f"{key}.{i}")
-        if value and key == "subdivisions":
-            # MaxMind orders subdivisions largest-to-smallest, so [-1]
-            # is the most specific (e.g., city-level) subdivision.
-            yield from _flatten_value(value[-1], f"{key}.-1")
-    else:
-        yield key, value
+    out: list[tuple[str, Any]] = []
+    append = out.append
+    # Children are pushed in reverse so they are popped in their original
+    # order, keeping the output order the same as the record's.
+    stack: list[tuple[tuple[str, ...], Any]] = [
+        ((f"{prefix}{key}",), value) for key, value in reversed(record.items())
+    ]
+    pop = stack.pop
+    subdivisions_path = (f"{prefix}subdivisions",)
+    while stack:
+        path, value = pop()
+        value_type = type(value)
+        if value_type is dict:
+            stack.extend(
+                ((*path, sub_key), sub_value)
+                for sub_key, sub_value in reversed(value.items())
+            )
+        elif value_type is list:
+            if value and path == subdivisions_path:
+                # MaxMind orders subdivisions largest-to-smallest, so [-1]
+                # is the most specific (e.g., city-level) subdivision.
+                stack.append(((*path, "-1"), value[-1]))
+            stack.extend(
+                ((*path, str(i)), item) for i, item in reversed(list(enumerate(value)))
+            )
+        else:
+            append((".".join(path), value))
+    return out
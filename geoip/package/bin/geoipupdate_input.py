@@ -13,7 +13,9 @@ if TYPE_CHECKING:
 
     from pygeoipupdate.models import UpdateResult
 
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
+_LIB_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "lib"))
+if _LIB_DIR not in sys.path:
+    sys.path.insert(0, _LIB_DIR)
 
 from geoip_utils import (
     APP_NAME,
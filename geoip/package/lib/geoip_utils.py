@@ -2,7 +2,9 @@
 
 import logging
 import os
-from functools import lru_cache
+import threading
+import time
+from functools import cache
 from pathlib import Path
 
 try:
@@ -60,6 +62,7 @@ SETTINGS_FIELD_SPECS = {
 }
 
 
+@cache
 def get_database_directory() -> Path:
     """Get the directory where MaxMind databases are stored.
 
@@ -80,6 +83,10 @@ def get_database_directory() -> Path:
     - https://docs.splunk.com/Documentation/Splunk/latest/Admin/Apparchitectureandobjectownership
     - https://docs.splunk.com/Documentation/Splunk/latest/Admin/Configurationfiledirectories
 
+    The result is cached since the environment does not change during the
+    life of the process. Tests that change the environment must call
+    get_database_directory.cache_clear().
+
     Returns:
         Path to the database directory.
 
@@ -89,21 +96,53 @@ def get_database_directory() -> Path:
         return Path(env_dir)
 
     splunk_home = os.environ.get("SPLUNK_HOME", "/opt/splunk")
-    return Path(splunk_home, "etc", "apps", APP_NAME, "local", "data")
+    return Path(os.path.join(splunk_home, "etc", "apps", APP_NAME, "local", "data"))
+
+
+def get_database_path(name: str) -> str:
+    """Get the path of a MaxMind database file.
+
+    Args:
+        name: The database name (e.g., 'GeoIP2-Country'), which must already
+            be validated as safe to use in a file name
+
+    Returns:
+        Path to the .mmdb file in the database directory, as a string.
+
+    """
+    return os.path.join(get_database_directory(), f"{name}.mmdb")
 
 
+@cache
 def get_fallback_logger() -> logging.Logger:
     """Get a basic logger for use when no session key is available.
 
     The log level is hardcoded to INFO since without a session key we
-    cannot read the user's configured level from Splunk's REST API.
+    cannot read the user's configured level from Splunk's REST API. The
+    result is cached so the level is only set on the first call.
     """
     logger = logging.getLogger(APP_NAME)
     logger.setLevel(logging.INFO)
     return logger
 
 
-@lru_cache(maxsize=1)
+# Seconds to reuse the configured log level before reading it again. The
+# level is a global setting, so it is not re-read for each session key, but
+# it is refreshed periodically so long-running processes (e.g., the REST
+# handler's background updates) pick up changes made on the Logging tab.
+_LOG_LEVEL_TTL = 60.0
+
+# The app logger, created on the first call to get_logger, and the
+# time.monotonic() value at which its level was last read.
+_logger: logging.Logger | None = None
+_log_level_read_at = 0.0
+
+# Serializes creating the logger and refreshing its level. The REST
+# handlers call get_logger from both the request thread and the background
+# update thread.
+_logger_lock = threading.Lock()
+
+
 def get_logger(session_key: str) -> logging.Logger:
     """Get a logger configured with the app's log level setting.
 
@@ -111,20 +150,36 @@ def get_logger(session_key: str) -> logging.Logger:
     from Splunk's REST API. Without it, the log level would be hardcoded
     and the Logging tab in the UI would have no effect.
 
-    The result is cached to avoid repeated REST API calls. Only one logger
-    is cached; concurrent searches with different session keys will evict
-    each other's cached loggers, but this is acceptable since the log level
-    setting is global anyway.
+    The logger is created once per process. Its level is read again only
+    after _LOG_LEVEL_TTL seconds, regardless of the session key, to avoid
+    repeated REST API calls. Any valid session key can read the level since
+    the setting is global.
     """
+    global _logger, _log_level_read_at  # noqa: PLW0603
+
     if not _HAS_SOLNLIB:
         return get_fallback_logger()
 
-    logger: logging.Logger = solnlib_log.Logs().get_logger(APP_NAME)
-    log_level = conf_manager.get_log_level(
-        logger=logger,
-        session_key=session_key,
-        app_name=APP_NAME,
-        conf_name=CONF_NAME,
-    )
-    logger.setLevel(log_level)
-    return logger
+    if _logger is not None and time.monotonic() - _log_level_read_at < _LOG_LEVEL_TTL:
+        return _logger
+
+    with _logger_lock:
+        # Another thread may have refreshed the level while we waited
+        now = time.monotonic()
+        if _logger is not None and now - _log_level_read_at < _LOG_LEVEL_TTL:
+            return _logger
+
+        logger: logging.Logger = _logger or solnlib_log.Logs().get_logger(APP_NAME)
+        log_level = conf_manager.get_log_level(
+            logger=logger,
+            session_key=session_key,
+            app_name=APP_NAME,
+            conf_name=CONF_NAME,
+        )
+        # setLevel clears the logging module's level caches, so skip it when
+        # the configured level has not changed since the last refresh
+        if logging.getLevelName(logger.level) != log_level:
+            logger.setLevel(log_level)
+        _logger = logger
+        _log_level_read_at = now
+        return logger
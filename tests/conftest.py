@@ -1,7 +1,10 @@
 import os
 import sys
+from collections.abc import Iterator
 from pathlib import Path
 
+import pytest
+
 # Set the test database directory before importing maxmind_command
 repo_root = Path(__file__).parent.parent
 test_db_dir = repo_root / "tests" / "data" / "test-data"
@@ -10,5 +13,16 @@ os.environ["MAXMIND_DB_DIR"] = str(test_db_dir)
 # Add the package bin and lib directories to the path
 bin_dir = repo_root / "geoip" / "package" / "bin"
 lib_dir = repo_root / "geoip" / "package" / "lib"
-sys.path.insert(0, str(bin_dir))
-sys.path.insert(0, str(lib_dir))
+for path in (str(bin_dir), str(lib_dir)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture(autouse=True)
+def _clear_database_directory_cache() -> Iterator[None]:
+    """Recompute the database directory for tests that change the environment."""
+    from geoip_utils import get_database_directory  # noqa: PLC0415
+
+    get_database_directory.cache_clear()
+    yield
+    get_database_directory.cache_clear()
@@ -4,10 +4,15 @@ Uses test data from the MaxMind-DB submodule. Test IPs are from
 GeoIP2-Country-Test.mmdb which contains known test data.
 """
 
-from typing import TYPE_CHECKING
+import logging
+from ipaddress import ip_network
+from typing import TYPE_CHECKING, Any
+from unittest.mock import MagicMock
 
 import geoip_command
+import maxminddb
 import pytest
+from geoip_utils import get_database_path
 
 if TYPE_CHECKING:
     from geoip_command import Metadata, SearchInfo
@@ -30,7 +35,7 @@ class MockMetadata:
 
 
 class MockCommand:
-    """Mock command object that provides field, prefix, and databases attributes."""
+    """Mock command object that provides the geoip command arguments."""
 
     metadata: "Metadata"
 
@@ -39,9 +44,11 @@ class MockCommand:
         field: str = "ip",
         prefix: str = "",
         databases: str = "GeoIP2-Country-Test",
+        fields: str = "",
     ) -> None:
         self.field = field
         self.prefix = prefix
+        self.fields = fields
         self.databases = databases
         self.metadata = MockMetadata()
 
@@ -83,8 +90,8 @@ EXPECTED_US = {
     "network": "214.78.120.0/22",
 }
 
-EXPECTED_JP = {
-    "ip": "2001:218::1",
+# Continent fields shared by the Asian test IPs
+EXPECTED_CONTINENT_ASIA = {
     "continent.code": "AS",
     "continent.geoname_id": 6255147,
     "continent.names.de": "Asien",
@@ -95,6 +102,11 @@ EXPECTED_JP = {
     "continent.names.pt-BR": "Ásia",
     "continent.names.ru": "Азия",
     "continent.names.zh-CN": "亚洲",
+}
+
+EXPECTED_JP = {
+    "ip": "2001:218::1",
+    **EXPECTED_CONTINENT_ASIA,
     "country.geoname_id": 1861060,
     "country.iso_code": "JP",
     "country.names.de": "Japan",
@@ -120,16 +132,7 @@ EXPECTED_JP = {
 
 EXPECTED_KR = {
     "ip": "2001:220::1",
-    "continent.code": "AS",
-    "continent.geoname_id": 6255147,
-    "continent.names.de": "Asien",
-    "continent.names.en": "Asia",
-    "continent.names.es": "Asia",
-    "continent.names.fr": "Asie",
-    "continent.names.ja": "アジア",
-    "continent.names.pt-BR": "Ásia",
-    "continent.names.ru": "Азия",
-    "continent.names.zh-CN": "亚洲",
+    **EXPECTED_CONTINENT_ASIA,
     "country.geoname_id": 1835841,
     "country.iso_code": "KR",
     "country.names.de": "Republik Korea",
@@ -154,109 +157,122 @@ EXPECTED_KR = {
 }
 
 
-def test_valid_ipv4_us() -> None:
-    command = MockCommand(field="ip")
-    results = list(geoip_command.stream(command, iter([{"ip": "214.78.120.1"}])))
-
-    assert results == [EXPECTED_US]
-
-
-def test_valid_ipv6_jp() -> None:
-    command = MockCommand(field="ip")
-    results = list(geoip_command.stream(command, iter([{"ip": "2001:218::1"}])))
-
-    assert results == [EXPECTED_JP]
-
-
-def test_valid_ipv6_kr() -> None:
-    command = MockCommand(field="ip")
-    results = list(geoip_command.stream(command, iter([{"ip": "2001:220::1"}])))
-
-    assert results == [EXPECTED_KR]
-
-
-def test_invalid_ip_format() -> None:
-    command = MockCommand(field="ip")
-    results = list(geoip_command.stream(command, iter([{"ip": "not.an.ip"}])))
-
-    assert results == [{"ip": "not.an.ip"}]
-
-
-def test_invalid_ip_out_of_range() -> None:
+def test_stream_table() -> None:
+    """Test lookups for a variety of inputs, all fed through one stream call."""
+    cases = [
+        ({"ip": "214.78.120.1"}, EXPECTED_US),
+        ({"ip": "2001:218::1"}, EXPECTED_JP),
+        ({"ip": "2001:220::1"}, EXPECTED_KR),
+        # Invalid IP addresses
+        ({"ip": "not.an.ip"}, {"ip": "not.an.ip"}),
+        ({"ip": "localhost"}, {"ip": "localhost"}),
+        ({"ip": "999.999.999.999"}, {"ip": "999.999.999.999"}),
+        ({"ip": "²14.78.120.1"}, {"ip": "²14.78.120.1"}),
+        ({"ip": "214.78.120.01"}, {"ip": "214.78.120.01"}),
+        ({"ip": ""}, {"ip": ""}),
+        # IP addresses not in the database
+        ({"ip": "8.8.8.8"}, {"ip": "8.8.8.8"}),
+        ({"ip": "192.168.1.1"}, {"ip": "192.168.1.1"}),
+        # Missing IP field
+        ({"other_field": "value"}, {"other_field": "value"}),
+    ]
     command = MockCommand(field="ip")
-    events = iter([{"ip": "999.999.999.999"}])
-    results = list(geoip_command.stream(command, events))
+    events = [event for event, _ in cases]
+    results = list(geoip_command.stream(command, iter(events)))
 
-    assert results == [{"ip": "999.999.999.999"}]
+    assert results == [expected for _, expected in cases]
 
 
-def test_invalid_ip_empty_string() -> None:
-    command = MockCommand(field="ip")
-    results = list(geoip_command.stream(command, iter([{"ip": ""}])))
+@pytest.fixture
+def flattened_records(monkeypatch: pytest.MonkeyPatch) -> list[dict[str, Any]]:
+    """Record each record flattened by stream(), starting with empty caches.
 
-    assert results == [{"ip": ""}]
+    Returns:
+        The records passed to _flatten_record, in order.
 
+    """
+    flatten_record = geoip_command._flatten_record
+    flattened: list[dict[str, Any]] = []
 
-def test_ip_not_in_database() -> None:
-    command = MockCommand(field="ip")
-    results = list(geoip_command.stream(command, iter([{"ip": "8.8.8.8"}])))
+    def recording_flatten_record(
+        record: dict[str, Any],
+        prefix: str = "",
+    ) -> list[tuple[str, Any]]:
+        flattened.append(record)
+        return flatten_record(record, prefix)
 
-    assert results == [{"ip": "8.8.8.8"}]
+    monkeypatch.setattr(geoip_command, "_flatten_record", recording_flatten_record)
+    monkeypatch.setattr(geoip_command, "_lookups", {})
+    return flattened
 
 
-def test_private_ip_not_in_database() -> None:
+def test_repeated_ip(flattened_records: list[dict[str, Any]]) -> None:
+    """Test that events sharing an IP address are enriched from the cache."""
     command = MockCommand(field="ip")
-    results = list(geoip_command.stream(command, iter([{"ip": "192.168.1.1"}])))
+    events = [{"ip": "214.78.120.1"}, {"ip": "invalid"}, {"ip": "214.78.120.1"}]
+    results = list(geoip_command.stream(command, iter(events)))
 
-    assert results == [{"ip": "192.168.1.1"}]
+    assert results == [EXPECTED_US, {"ip": "invalid"}, EXPECTED_US]
+    assert len(flattened_records) == 1
 
 
-def test_missing_field() -> None:
+def test_lookup_cache_shared_across_calls(
+    flattened_records: list[dict[str, Any]],
+) -> None:
+    """Test that an IP address looked up in one batch is cached for the next."""
     command = MockCommand(field="ip")
-    events = iter([{"other_field": "value"}])
-    results = list(geoip_command.stream(command, events))
 
-    assert results == [{"other_field": "value"}]
+    first = next(geoip_command.stream(command, iter([{"ip": "214.78.120.1"}])))
+    second = next(geoip_command.stream(command, iter([{"ip": "214.78.120.1"}])))
 
-
-def test_multiple_events() -> None:
-    command = MockCommand(field="ip")
-    events = [
-        {"ip": "214.78.120.1"},
-        {"ip": "invalid"},
-        {"other": "field"},
-    ]
-    results = list(geoip_command.stream(command, iter(events)))
-
-    assert results == [EXPECTED_US, {"ip": "invalid"}, {"other": "field"}]
+    assert first == second == EXPECTED_US
+    assert len(flattened_records) == 1
 
 
 def test_default_field() -> None:
     command = MockCommand()
-    results = list(geoip_command.stream(command, iter([{"ip": "214.78.120.1"}])))
+    result = next(geoip_command.stream(command, iter([{"ip": "214.78.120.1"}])))
 
-    assert results == [EXPECTED_US]
+    assert result == EXPECTED_US
 
 
 def test_custom_field() -> None:
     command = MockCommand(field="src_ip")
     events = iter([{"src_ip": "214.78.120.1"}])
-    results = list(geoip_command.stream(command, events))
+    result = next(geoip_command.stream(command, events))
 
-    expected = {k: v for k, v in EXPECTED_US.items() if k != "ip"}
-    expected["src_ip"] = "214.78.120.1"
-    assert results == [expected]
+    expected = {**EXPECTED_US, "src_ip": "214.78.120.1"}
+    del expected["ip"]
+    assert result == expected
 
 
 def test_prefix() -> None:
     command = MockCommand(prefix="maxmind_")
-    results = list(geoip_command.stream(command, iter([{"ip": "214.78.120.1"}])))
+    result = next(geoip_command.stream(command, iter([{"ip": "214.78.120.1"}])))
 
     expected: dict[str, object] = {"ip": "214.78.120.1"}
     for key, value in EXPECTED_US.items():
         if key != "ip":
             expected[f"maxmind_{key}"] = value
-    assert results == [expected]
+    assert result == expected
+
+
+def test_fields() -> None:
+    command = MockCommand(fields="country.iso_code, network")
+    result = next(geoip_command.stream(command, iter([{"ip": "214.78.120.1"}])))
+
+    assert result == {
+        "ip": "214.78.120.1",
+        "country.iso_code": "US",
+        "network": "214.78.120.0/22",
+    }
+
+
+def test_fields_with_prefix() -> None:
+    command = MockCommand(prefix="maxmind_", fields="country.iso_code")
+    result = next(geoip_command.stream(command, iter([{"ip": "214.78.120.1"}])))
+
+    assert result == {"ip": "214.78.120.1", "maxmind_country.iso_code": "US"}
 
 
 def test_flatten_record_flat_dict() -> None:
@@ -273,6 +289,43 @@ def test_flatten_record_nested_dict() -> None:
     assert result == {"country.iso_code": "US", "country.names.en": "United States"}
 
 
+def test_flatten_record_preserves_order() -> None:
+    record = {"city": {"names": {"en": "Linköping"}}, "country": {"iso_code": "SE"}}
+    result = geoip_command._flatten_record(record)
+
+    assert result == [("city.names.en", "Linköping"), ("country.iso_code", "SE")]
+
+
+def test_flatten_record_with_prefix() -> None:
+    record = {"country": {"iso_code": "US"}, "subdivisions": [{"iso_code": "CA"}]}
+    result = dict(geoip_command._flatten_record(record, "geo_"))
+
+    assert result == {
+        "geo_country.iso_code": "US",
+        "geo_subdivisions.0.iso_code": "CA",
+        "geo_subdivisions.-1.iso_code": "CA",
+    }
+
+
+def test_flatten_record_deeply_nested() -> None:
+    """Test that keys nested several levels deep are joined in order."""
+    record = {
+        "a": {"b": {"c": {"d": 1, "e": 2}, "f": 3}},
+        "g": {"h": {"i": {"j": [4, {"k": 5}]}}},
+        "l": 6,
+    }
+    result = geoip_command._flatten_record(record, "p_")
+
+    assert result == [
+        ("p_a.b.c.d", 1),
+        ("p_a.b.c.e", 2),
+        ("p_a.b.f", 3),
+        ("p_g.h.i.j.0", 4),
+        ("p_g.h.i.j.1.k", 5),
+        ("p_l", 6),
+    ]
+
+
 def test_flatten_record_empty_dict() -> None:
     result = dict(geoip_command._flatten_record({}))
 
@@ -284,10 +337,8 @@ def test_multiple_databases() -> None:
     # 89.160.20.112 is in both Country-Test and City-Test
     # City has additional fields like city.names.en
     command = MockCommand(databases="GeoIP2-Country-Test,GeoIP2-City-Test")
-    results = list(geoip_command.stream(command, iter([{"ip": "89.160.20.112"}])))
+    result = next(geoip_command.stream(command, iter([{"ip": "89.160.20.112"}])))
 
-    assert len(results) == 1
-    result = results[0]
     # Should have country fields from both (City overwrites Country)
     assert result["country.iso_code"] == "SE"
     # Should have city fields from City-Test (Country doesn't have these)
@@ -301,10 +352,9 @@ def test_multiple_databases_smallest_network() -> None:
     # - GeoIP2-ISP-Test with /29 (more specific)
     # Should return /29 (the most specific)
     command = MockCommand(databases="GeoIP2-Country-Test,GeoIP2-ISP-Test")
-    results = list(geoip_command.stream(command, iter([{"ip": "89.160.20.112"}])))
+    result = next(geoip_command.stream(command, iter([{"ip": "89.160.20.112"}])))
 
-    assert len(results) == 1
-    assert results[0]["network"] == "89.160.20.112/29"
+    assert result["network"] == "89.160.20.112/29"
 
 
 def test_multiple_databases_last_wins() -> None:
@@ -312,11 +362,10 @@ def test_multiple_databases_last_wins() -> None:
     # Use City and Country which both have country.iso_code
     # The second database in the list should win
     command = MockCommand(databases="GeoIP2-City-Test,GeoIP2-Country-Test")
-    results = list(geoip_command.stream(command, iter([{"ip": "214.78.120.1"}])))
+    result = next(geoip_command.stream(command, iter([{"ip": "214.78.120.1"}])))
 
-    assert len(results) == 1
     # Both have this field, Country-Test (second) should win
-    assert results[0]["country.iso_code"] == "US"
+    assert result["country.iso_code"] == "US"
 
 
 def test_database_not_found() -> None:
@@ -335,14 +384,24 @@ def test_invalid_database_name() -> None:
         list(geoip_command.stream(command, iter([{"ip": "1.2.3.4"}])))
 
 
+def test_parse_database_names() -> None:
+    result = geoip_command._parse_database_names(" GeoIP2-City , GeoLite2_ASN")
+
+    assert result == ("GeoIP2-City", "GeoLite2_ASN")
+
+
+def test_parse_database_names_rejects_invalid_names() -> None:
+    for databases in ("", "GeoIP2-City,", "GeoIP2 City", "GéoIP2-City", "a/b"):
+        with pytest.raises(ValueError, match="Invalid database name"):
+            geoip_command._parse_database_names(databases)
+
+
 def test_ip_in_one_database_only() -> None:
     """Test lookup when IP is only in one of multiple databases."""
     # 214.78.120.1 is in Country but not in Anonymous-IP
     command = MockCommand(databases="GeoIP2-Country-Test,GeoIP2-Anonymous-IP-Test")
-    results = list(geoip_command.stream(command, iter([{"ip": "214.78.120.1"}])))
+    result = next(geoip_command.stream(command, iter([{"ip": "214.78.120.1"}])))
 
-    assert len(results) == 1
-    result = results[0]
     # Should have country fields
     assert result["country.iso_code"] == "US"
     # Should not have anonymous fields (not in that database)
@@ -386,13 +445,73 @@ def test_subdivisions_flattened() -> None:
     """Test that subdivisions from City database are properly flattened."""
     # 89.160.20.112 has subdivisions in GeoIP2-City-Test
     command = MockCommand(databases="GeoIP2-City-Test")
-    results = list(geoip_command.stream(command, iter([{"ip": "89.160.20.112"}])))
+    result = next(geoip_command.stream(command, iter([{"ip": "89.160.20.112"}])))
 
-    assert len(results) == 1
-    result = results[0]
     # Subdivisions should be flattened with numeric index
     assert result["subdivisions.0.iso_code"] == "E"
     assert result["subdivisions.0.names.en"] == "Östergötland County"
     # Last subdivision is also available at -1
     assert result["subdivisions.-1.iso_code"] == "E"
     assert result["subdivisions.-1.names.en"] == "Östergötland County"
+
+
+def test_open_database_falls_back_without_extension(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that the pure Python reader is used when the C extension is missing."""
+    open_database = maxminddb.open_database
+    modes = []
+
+    def fake_open_database(database: str, mode: int) -> maxminddb.Reader:
+        modes.append(mode)
+        if mode == maxminddb.MODE_MMAP_EXT:
+            msg = "MODE_MMAP_EXT requires the maxminddb.extension module"
+            raise ValueError(msg)
+        return open_database(database, mode)
+
+    monkeypatch.setattr(maxminddb, "open_database", fake_open_database)
+    db_path = get_database_path("GeoIP2-Country-Test")
+
+    logger = MagicMock(spec=logging.Logger)
+
+    reader = geoip_command._open_database(db_path, logger)
+
+    assert modes == [maxminddb.MODE_MMAP_EXT, maxminddb.MODE_MMAP]
+    logger.warning.assert_called_once()
+    assert reader.get("214.78.120.1") is not None
+    reader.close()
+
+
+def test_looks_like_ip() -> None:
+    for value in ("214.78.120.1", "255.0.10.1", "2001:218::1", "::ffff:1.2.3.4"):
+        assert geoip_command._looks_like_ip(value), value
+    invalid = (
+        "",
+        "localhost",
+        "not.an.ip",
+        "999.999.999.999",
+        "1.2.3",
+        "1.2.3.4.",
+        "²14.78.120.1",
+        "214.78.120.01",
+    )
+    for value in invalid:
+        assert not geoip_command._looks_like_ip(value), value
+
+
+def test_format_network_ipv4() -> None:
+    assert geoip_command._format_network("214.78.120.1", 22) == "214.78.120.0/22"
+    assert geoip_command._format_network("89.160.20.112", 32) == "89.160.20.112/32"
+    assert geoip_command._format_network("89.160.20.112", 0) == "0.0.0.0/0"
+
+
+def test_format_network_ipv6() -> None:
+    assert geoip_command._format_network("2001:218::1", 32) == "2001:218::/32"
+    assert geoip_command._format_network("2001:220::1", 128) == "2001:220::1/128"
+    assert (
+        geoip_command._format_network("2001:db8:0:0:1::1", 80) == "2001:db8:0:0:1::/80"
+    )
+    # ipaddress's formatting of IPv4-mapped addresses differs between Python
+    # versions, so the expectation comes from ipaddress itself
+    expected = str(ip_network("::ffff:1.2.3.4/120", strict=False))
+    assert geoip_command._format_network("::ffff:1.2.3.4", 120) == expected
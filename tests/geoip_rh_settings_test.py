@@ -11,13 +11,18 @@ import json
 from pathlib import Path
 from typing import Any
 
+import pytest
 from geoip_utils import SETTINGS_FIELD_SPECS
 
 repo_root = Path(__file__).parent.parent
 global_config_path = repo_root / "geoip" / "globalConfig.json"
 
+_ACCOUNT_SPECS_BY_FIELD = {s["field"]: s for s in SETTINGS_FIELD_SPECS["account"]}
 
-def _load_global_config() -> dict[str, Any]:
+
+@pytest.fixture(scope="module")
+def global_config() -> dict[str, Any]:
+    """Parse globalConfig.json once for all tests in this module."""
     with global_config_path.open() as f:
         return json.load(f)  # type: ignore[no-any-return]
 
@@ -28,9 +33,8 @@ def _get_config_tab(config: dict[str, Any], tab_name: str) -> dict[str, Any]:
     return next(t for t in tabs if t.get("name") == tab_name)
 
 
-def test_account_field_names_match() -> None:
-    config = _load_global_config()
-    account_tab = _get_config_tab(config, "account")
+def test_account_field_names_match(global_config: dict[str, Any]) -> None:
+    account_tab = _get_config_tab(global_config, "account")
 
     config_fields = [e["field"] for e in account_tab["entity"]]
     spec_fields = [f["field"] for f in SETTINGS_FIELD_SPECS["account"]]
@@ -38,15 +42,14 @@ def test_account_field_names_match() -> None:
     assert spec_fields == config_fields
 
 
-def test_account_field_required_and_encrypted_match() -> None:
-    config = _load_global_config()
-    account_tab = _get_config_tab(config, "account")
+def test_account_field_required_and_encrypted_match(
+    global_config: dict[str, Any],
+) -> None:
+    account_tab = _get_config_tab(global_config, "account")
 
     for entity in account_tab["entity"]:
         field_name = entity["field"]
-        spec = next(
-            s for s in SETTINGS_FIELD_SPECS["account"] if s["field"] == field_name
-        )
+        spec = _ACCOUNT_SPECS_BY_FIELD[field_name]
 
         assert spec["required"] == entity.get("required", False), (
             f"'required' mismatch for field '{field_name}'"
@@ -56,15 +59,12 @@ def test_account_field_required_and_encrypted_match() -> None:
         )
 
 
-def test_account_validator_patterns_match() -> None:
-    config = _load_global_config()
-    account_tab = _get_config_tab(config, "account")
+def test_account_validator_patterns_match(global_config: dict[str, Any]) -> None:
+    account_tab = _get_config_tab(global_config, "account")
 
     for entity in account_tab["entity"]:
         field_name = entity["field"]
-        spec = next(
-            s for s in SETTINGS_FIELD_SPECS["account"] if s["field"] == field_name
-        )
+        spec = _ACCOUNT_SPECS_BY_FIELD[field_name]
 
         config_validators: list[dict[str, Any]] = entity.get("validators", [])
         spec_validators: list[dict[str, Any]] = spec.get("validators", [])  # type: ignore[assignment]
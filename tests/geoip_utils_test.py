@@ -2,18 +2,14 @@
 
 from __future__ import annotations
 
-import sys
+import logging
 from pathlib import Path
 from typing import TYPE_CHECKING
+from unittest.mock import MagicMock
 
 if TYPE_CHECKING:
     from _pytest.monkeypatch import MonkeyPatch
 
-# Add the lib directory to the path for testing
-repo_root = Path(__file__).parent.parent
-lib_dir = repo_root / "geoip" / "package" / "lib"
-sys.path.insert(0, str(lib_dir))
-
 
 def test_get_database_directory_with_env_override(
     tmp_path: Path,
@@ -37,3 +33,86 @@ def test_get_database_directory_default(monkeypatch: MonkeyPatch) -> None:
 
     result = geoip_utils.get_database_directory()
     assert result == Path("/opt/splunk/etc/apps/geoip/local/data")
+
+
+def test_get_database_path(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    """Test that the database path is built from the directory and name."""
+    monkeypatch.setenv("MAXMIND_DB_DIR", str(tmp_path))
+
+    import geoip_utils  # noqa: PLC0415
+
+    result = geoip_utils.get_database_path("GeoIP2-City")
+    assert result == str(tmp_path / "GeoIP2-City.mmdb")
+
+
+def test_get_logger_reuses_log_level_across_session_keys(
+    monkeypatch: MonkeyPatch,
+) -> None:
+    """Test that the log level is only re-read after the TTL expires."""
+    import geoip_utils  # noqa: PLC0415
+
+    logger = logging.getLogger("geoip_utils_test")
+    conf_manager = MagicMock()
+    conf_manager.get_log_level.return_value = "DEBUG"
+    solnlib_log = MagicMock()
+    solnlib_log.Logs.return_value.get_logger.return_value = logger
+
+    monkeypatch.setattr(geoip_utils, "_HAS_SOLNLIB", True)
+    monkeypatch.setattr(geoip_utils, "conf_manager", conf_manager, raising=False)
+    monkeypatch.setattr(geoip_utils, "solnlib_log", solnlib_log, raising=False)
+    monkeypatch.setattr(geoip_utils, "_logger", None)
+    monkeypatch.setattr(geoip_utils, "_log_level_read_at", 0.0)
+
+    assert geoip_utils.get_logger("key1") is logger
+    assert geoip_utils.get_logger("key2") is logger
+    conf_manager.get_log_level.assert_called_once()
+    assert logger.level == logging.DEBUG
+
+    # Age the cached level past the TTL
+    monkeypatch.setattr(
+        geoip_utils,
+        "_log_level_read_at",
+        geoip_utils._log_level_read_at - geoip_utils._LOG_LEVEL_TTL,
+    )
+    conf_manager.get_log_level.reset_mock()
+    conf_manager.get_log_level.return_value = "ERROR"
+    assert geoip_utils.get_logger("key3") is logger
+    conf_manager.get_log_level.assert_called_once()
+    assert conf_manager.get_log_level.call_args.kwargs["session_key"] == "key3"
+    assert logger.level == logging.ERROR
+    solnlib_log.Logs.assert_called_once()
+
+
+def test_get_fallback_logger() -> None:
+    """Test that the fallback logger is configured once and reused."""
+    import geoip_utils  # noqa: PLC0415
+
+    logger = geoip_utils.get_fallback_logger()
+
+    assert logger.name == geoip_utils.APP_NAME
+    assert logger.level == logging.INFO
+    assert geoip_utils.get_fallback_logger() is logger
+
+
+def test_get_logger_skips_unchanged_log_level(monkeypatch: MonkeyPatch) -> None:
+    """Test that refreshing an unchanged log level does not call setLevel."""
+    import geoip_utils  # noqa: PLC0415
+
+    logger = logging.getLogger("geoip_utils_test_unchanged")
+    logger.setLevel(logging.WARNING)
+    conf_manager = MagicMock()
+    conf_manager.get_log_level.return_value = "WARNING"
+    solnlib_log = MagicMock()
+    solnlib_log.Logs.return_value.get_logger.return_value = logger
+    set_level = MagicMock()
+
+    monkeypatch.setattr(geoip_utils, "_HAS_SOLNLIB", True)
+    monkeypatch.setattr(geoip_utils, "conf_manager", conf_manager, raising=False)
+    monkeypatch.setattr(geoip_utils, "solnlib_log", solnlib_log, raising=False)
+    monkeypatch.setattr(geoip_utils, "_logger", None)
+    monkeypatch.setattr(geoip_utils, "_log_level_read_at", 0.0)
+    monkeypatch.setattr(logger, "setLevel", set_level)
+
+    assert geoip_utils.get_logger("key") is logger
+    conf_manager.get_log_level.assert_called_once()
+    set_level.assert_not_called()
@@ -2,29 +2,22 @@
 
 from __future__ import annotations
 
-import gzip
-import hashlib
 import io
-import logging
 import sys
 import tarfile
-from pathlib import Path
-from typing import TYPE_CHECKING
-from unittest.mock import AsyncMock, MagicMock, patch
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Self, cast
+from unittest.mock import MagicMock
 
 import pytest
 
 if TYPE_CHECKING:
+    import logging
+    from pathlib import Path
+
     from _pytest.monkeypatch import MonkeyPatch
     from pytest_httpserver import HTTPServer
 
-# Add the lib and bin directories to the path for testing
-repo_root = Path(__file__).parent.parent
-lib_dir = repo_root / "geoip" / "package" / "lib"
-bin_dir = repo_root / "geoip" / "package" / "bin"
-sys.path.insert(0, str(lib_dir))
-sys.path.insert(0, str(bin_dir))
-
 # Mock solnlib before importing geoipupdate_input since solnlib is not
 # installed in the dev environment (it's only in the app's runtime deps)
 mock_conf_manager = MagicMock()
@@ -65,179 +58,197 @@ from pygeoipupdate.errors import (  # noqa: E402  # type: ignore[import-not-foun
 # Test account ID used across tests
 TEST_ACCOUNT_ID = 12345
 
+# MD5 of _create_test_mmdb(), as reported by the metadata endpoint
+TEST_MMDB_MD5 = "995cfe63cfe3e8f6b59dfe4db95cd0f8"
 
-def test_get_scheme() -> None:
-    """Test that get_scheme returns the expected structure."""
-    input_obj = GeoIPUpdateInput()
-    scheme = input_obj.get_scheme()
+# Content type and headers of the download endpoint's response
+TEST_DOWNLOAD_CONTENT_TYPE = "application/gzip"
+TEST_DOWNLOAD_HEADERS = {"Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"}
 
-    assert scheme["title"] == "GeoIP Database Update"
-    assert scheme["description"] == "Downloads and updates MaxMind GeoIP databases"
-    assert scheme["use_external_validation"] is False
-    assert scheme["streaming_mode_xml"] is True
-    assert scheme["use_single_instance"] is False
-    assert scheme["args"] == ["run_only_one"]
+# The modular input under test. It holds no state, so one instance is shared.
+MODULAR_INPUT = GeoIPUpdateInput()
 
+# Modular input definition with a session key, shared by the stream_events tests
+TEST_INPUTS = SimpleNamespace(metadata={"session_key": "test_session_key"})
 
-def test_validate_input_does_nothing() -> None:
-    """Test that validate_input accepts any input without raising."""
-    input_obj = GeoIPUpdateInput()
-    # Should not raise
-    input_obj.validate_input(None)
-    input_obj.validate_input({"anything": "here"})
 
+class _FakeUpdater:
+    """Stand-in for pygeoipupdate.Updater that returns canned results."""
 
-def test_stream_events_returns_without_session_key() -> None:
-    """Test that stream_events returns when no session key."""
-    input_obj = GeoIPUpdateInput()
+    def __init__(self, results: list[SimpleNamespace]) -> None:
+        self._results = results
 
-    # Mock inputs with empty session key
-    inputs = MagicMock()
-    inputs.metadata = {"session_key": ""}
+    async def __aenter__(self) -> Self:
+        return self
 
-    input_obj.stream_events(inputs, None)
+    async def __aexit__(self, *_exc_info: object) -> None:
+        return None
 
+    async def run(self) -> list[SimpleNamespace]:
+        return self._results
 
-def test_stream_events_returns_with_missing_session_key() -> None:
-    """Test that stream_events returns when session key missing."""
-    input_obj = GeoIPUpdateInput()
 
-    # Mock inputs with no session key in metadata
-    inputs = MagicMock()
-    inputs.metadata = {}
+class _RecordingLogger:
+    """Stand-in for logging.Logger that records the calls made to it."""
 
-    input_obj.stream_events(inputs, None)
+    def __init__(self) -> None:
+        self.records: list[tuple[str, tuple[object, ...]]] = []
 
+    def info(self, *args: object) -> None:
+        self.records.append(("info", args))
 
-def test_stream_events_handles_missing_credentials(
-    tmp_path: Path,
-    monkeypatch: MonkeyPatch,
-) -> None:
-    """Test that stream_events logs warning when credentials not configured."""
-    monkeypatch.setenv("MAXMIND_DB_DIR", str(tmp_path))
+    def warning(self, *args: object) -> None:
+        self.records.append(("warning", args))
 
-    input_obj = GeoIPUpdateInput()
+    def exception(self, *args: object) -> None:
+        self.records.append(("exception", args))
 
-    inputs = MagicMock()
-    inputs.metadata = {"session_key": "test_session_key"}
 
-    mock_logger = MagicMock(spec=logging.Logger)
+def _install_conf(conf: object) -> None:
+    """Make ConfManager(...).get_conf() return conf, or raise it if an exception."""
 
-    with (
-        patch("geoipupdate_input.get_logger", return_value=mock_logger),
-        patch(
-            "geoipupdate_input._get_account_credentials",
-            side_effect=ValueError("Credentials not configured"),
-        ),
-    ):
-        input_obj.stream_events(inputs, None)
-
-    # Verify warning was logged
-    mock_logger.warning.assert_called_once()
-    assert "Skipping database update" in mock_logger.warning.call_args[0][0]
+    def get_conf(_name: str) -> object:
+        if isinstance(conf, Exception):
+            raise conf
+        return conf
 
+    mock_conf_manager.ConfManager = lambda *_args, **_kwargs: SimpleNamespace(
+        get_conf=get_conf,
+    )
 
-def test_stream_events_handles_missing_databases(
-    tmp_path: Path,
-    monkeypatch: MonkeyPatch,
-) -> None:
-    """Test that stream_events logs warning when no databases configured."""
-    monkeypatch.setenv("MAXMIND_DB_DIR", str(tmp_path))
 
-    input_obj = GeoIPUpdateInput()
+def _install_account_stanza(stanza: dict[str, str] | Exception) -> None:
+    """Make the settings conf return the account stanza, or raise it."""
 
-    inputs = MagicMock()
-    inputs.metadata = {"session_key": "test_session_key"}
+    def get(_name: str, **_kwargs: object) -> dict[str, str]:
+        if isinstance(stanza, Exception):
+            raise stanza
+        return stanza
 
-    mock_logger = MagicMock(spec=logging.Logger)
+    _install_conf(SimpleNamespace(get=get))
 
-    with (
-        patch("geoipupdate_input.get_logger", return_value=mock_logger),
-        patch(
-            "geoipupdate_input._get_account_credentials",
-            return_value=(TEST_ACCOUNT_ID, "key"),
-        ),
-        patch(
-            "geoipupdate_input._get_database_names",
-            side_effect=ValueError("No databases configured"),
-        ),
-    ):
-        input_obj.stream_events(inputs, None)
 
-    mock_logger.warning.assert_called_once()
-    assert "Skipping database update" in mock_logger.warning.call_args[0][0]
+def _install_database_stanzas(stanzas: dict[str, dict[str, str]] | Exception) -> None:
+    """Make the databases conf return the stanzas, or raise when it is opened."""
+    if isinstance(stanzas, Exception):
+        _install_conf(stanzas)
+    else:
+        _install_conf(SimpleNamespace(get_all=lambda **_kwargs: stanzas))
 
 
-def test_stream_events_handles_geoipupdate_error(
-    tmp_path: Path,
-    monkeypatch: MonkeyPatch,
-) -> None:
-    """Test that stream_events logs exception on GeoIPUpdateError."""
-    monkeypatch.setenv("MAXMIND_DB_DIR", str(tmp_path))
+@pytest.fixture
+def logger() -> _RecordingLogger:
+    """Create a logger that records calls for asserting on them."""
+    return _RecordingLogger()
 
-    input_obj = GeoIPUpdateInput()
 
-    inputs = MagicMock()
-    inputs.metadata = {"session_key": "test_session_key"}
+@pytest.fixture
+def stub_update(monkeypatch: MonkeyPatch, logger: _RecordingLogger) -> None:
+    """Replace the steps of the update with canned results."""
+    monkeypatch.setattr("geoipupdate_input.get_logger", lambda _key: logger)
+    monkeypatch.setattr(
+        "geoipupdate_input._get_account_credentials",
+        lambda _key: (TEST_ACCOUNT_ID, "key"),
+    )
+    monkeypatch.setattr(
+        "geoipupdate_input._get_database_names",
+        lambda _key: ["GeoLite2-Country"],
+    )
+    monkeypatch.setattr("geoipupdate_input._run_update", lambda **_kwargs: None)
 
-    mock_logger = MagicMock(spec=logging.Logger)
 
-    with (
-        patch("geoipupdate_input.get_logger", return_value=mock_logger),
-        patch(
-            "geoipupdate_input._get_account_credentials",
-            return_value=(TEST_ACCOUNT_ID, "key"),
-        ),
-        patch(
-            "geoipupdate_input._get_database_names",
-            return_value=["GeoLite2-Country"],
-        ),
-        patch(
-            "geoipupdate_input._run_update",
-            side_effect=GeoIPUpdateError("Download failed"),
-        ),
-    ):
-        input_obj.stream_events(inputs, None)
+@pytest.fixture
+def db_dir(tmp_path: Path, monkeypatch: MonkeyPatch) -> Path:
+    """Point the database directory at a temporary directory."""
+    monkeypatch.setenv("MAXMIND_DB_DIR", str(tmp_path))
+    return tmp_path
 
-    mock_logger.exception.assert_called_once_with("Database update failed")
 
+def test_get_scheme() -> None:
+    """Test that get_scheme returns the expected structure."""
+    scheme = MODULAR_INPUT.get_scheme()
 
-def test_stream_events_handles_unexpected_error(
-    tmp_path: Path,
-    monkeypatch: MonkeyPatch,
-) -> None:
-    """Test that stream_events logs exception on unexpected errors."""
-    monkeypatch.setenv("MAXMIND_DB_DIR", str(tmp_path))
+    assert scheme["title"] == "GeoIP Database Update"
+    assert scheme["description"] == "Downloads and updates MaxMind GeoIP databases"
+    assert scheme["use_external_validation"] is False
+    assert scheme["streaming_mode_xml"] is True
+    assert scheme["use_single_instance"] is False
+    assert scheme["args"] == ["run_only_one"]
 
-    input_obj = GeoIPUpdateInput()
 
-    inputs = MagicMock()
-    inputs.metadata = {"session_key": "test_session_key"}
+def test_validate_input_does_nothing() -> None:
+    """Test that validate_input accepts any input without raising."""
+    # Should not raise
+    MODULAR_INPUT.validate_input(None)
+    MODULAR_INPUT.validate_input({"anything": "here"})
 
-    mock_logger = MagicMock(spec=logging.Logger)
 
-    with (
-        patch("geoipupdate_input.get_logger", return_value=mock_logger),
-        patch(
-            "geoipupdate_input._get_account_credentials",
-            return_value=(TEST_ACCOUNT_ID, "key"),
+@pytest.mark.parametrize(
+    "metadata",
+    [
+        pytest.param({"session_key": ""}, id="empty_session_key"),
+        pytest.param({}, id="missing_session_key"),
+    ],
+)
+def test_stream_events_returns_without_session_key(
+    metadata: dict[str, str],
+) -> None:
+    """Test that stream_events returns when there is no session key."""
+    MODULAR_INPUT.stream_events(SimpleNamespace(metadata=metadata), None)
+
+
+@pytest.mark.usefixtures("db_dir", "stub_update")
+@pytest.mark.parametrize(
+    ("failing_function", "error", "expected_log"),
+    [
+        pytest.param(
+            "_get_account_credentials",
+            ValueError("Credentials not configured"),
+            ("warning", "Skipping database update: %s"),
+            id="missing_credentials",
         ),
-        patch(
-            "geoipupdate_input._get_database_names",
-            return_value=["GeoLite2-Country"],
+        pytest.param(
+            "_get_database_names",
+            ValueError("No databases configured"),
+            ("warning", "Skipping database update: %s"),
+            id="missing_databases",
         ),
-        patch(
-            "geoipupdate_input._run_update",
-            side_effect=RuntimeError("Something unexpected"),
+        pytest.param(
+            "_run_update",
+            GeoIPUpdateError("Download failed"),
+            ("exception", "Database update failed"),
+            id="geoipupdate_error",
         ),
-    ):
-        input_obj.stream_events(inputs, None)
+        pytest.param(
+            "_run_update",
+            RuntimeError("Something unexpected"),
+            ("exception", "Unexpected error during database update"),
+            id="unexpected_error",
+        ),
+    ],
+)
+def test_stream_events_handles_errors(
+    logger: _RecordingLogger,
+    monkeypatch: MonkeyPatch,
+    failing_function: str,
+    error: Exception,
+    expected_log: tuple[str, str],
+) -> None:
+    """Test that stream_events logs update errors instead of raising them."""
 
-    mock_logger.exception.assert_called_once_with(
-        "Unexpected error during database update"
-    )
+    def fail(*_args: object, **_kwargs: object) -> None:
+        raise error
+
+    monkeypatch.setattr(f"geoipupdate_input.{failing_function}", fail)
+
+    MODULAR_INPUT.stream_events(TEST_INPUTS, None)
+
+    log_method, log_message = expected_log
+    messages = [args[0] for level, args in logger.records if level == log_method]
+    assert messages == [log_message]
 
 
+@pytest.mark.usefixtures("stub_update")
 def test_stream_events_creates_database_directory(
     tmp_path: Path,
     monkeypatch: MonkeyPatch,
@@ -246,77 +257,25 @@ def test_stream_events_creates_database_directory(
     db_dir = tmp_path / "subdir" / "data"
     monkeypatch.setenv("MAXMIND_DB_DIR", str(db_dir))
 
-    input_obj = GeoIPUpdateInput()
-
-    inputs = MagicMock()
-    inputs.metadata = {"session_key": "test_session_key"}
-
-    mock_logger = MagicMock(spec=logging.Logger)
-
-    with (
-        patch("geoipupdate_input.get_logger", return_value=mock_logger),
-        patch(
-            "geoipupdate_input._get_account_credentials",
-            return_value=(TEST_ACCOUNT_ID, "key"),
-        ),
-        patch(
-            "geoipupdate_input._get_database_names",
-            return_value=["GeoLite2-Country"],
-        ),
-        patch(
-            "geoipupdate_input._run_update",
-        ),
-    ):
-        input_obj.stream_events(inputs, None)
+    MODULAR_INPUT.stream_events(TEST_INPUTS, None)
 
     assert db_dir.exists()
     assert db_dir.is_dir()
 
 
+@pytest.mark.usefixtures("db_dir", "stub_update")
 def test_stream_events_logs_success(
-    tmp_path: Path,
-    monkeypatch: MonkeyPatch,
+    logger: _RecordingLogger,
 ) -> None:
     """Test that stream_events logs success message after update completes."""
-    monkeypatch.setenv("MAXMIND_DB_DIR", str(tmp_path))
-
-    input_obj = GeoIPUpdateInput()
-
-    inputs = MagicMock()
-    inputs.metadata = {"session_key": "test_session_key"}
-
-    mock_logger = MagicMock(spec=logging.Logger)
+    MODULAR_INPUT.stream_events(TEST_INPUTS, None)
 
-    with (
-        patch("geoipupdate_input.get_logger", return_value=mock_logger),
-        patch(
-            "geoipupdate_input._get_account_credentials",
-            return_value=(TEST_ACCOUNT_ID, "key"),
-        ),
-        patch(
-            "geoipupdate_input._get_database_names",
-            return_value=["GeoLite2-Country"],
-        ),
-        patch(
-            "geoipupdate_input._run_update",
-        ),
-    ):
-        input_obj.stream_events(inputs, None)
-
-    mock_logger.info.assert_called_with("Database update completed successfully")
+    assert logger.records[-1] == ("info", ("Database update completed successfully",))
 
 
 def test_get_account_credentials_returns_credentials() -> None:
     """Test _get_account_credentials returns credentials from config."""
-    mock_stanza = {"account_id": "12345", "license_key": "secret_key"}
-
-    mock_conf = MagicMock()
-    mock_conf.get.return_value = mock_stanza
-
-    mock_cfm = MagicMock()
-    mock_cfm.get_conf.return_value = mock_conf
-
-    mock_conf_manager.ConfManager.return_value = mock_cfm
+    _install_account_stanza({"account_id": "12345", "license_key": "secret_key"})
 
     account_id, license_key = _get_account_credentials("session_key")
 
@@ -326,15 +285,7 @@ def test_get_account_credentials_returns_credentials() -> None:
 
 def test_get_account_credentials_raises_when_missing_account_id() -> None:
     """Test _get_account_credentials raises ValueError when account_id missing."""
-    mock_stanza = {"account_id": "", "license_key": "secret_key"}
-
-    mock_conf = MagicMock()
-    mock_conf.get.return_value = mock_stanza
-
-    mock_cfm = MagicMock()
-    mock_cfm.get_conf.return_value = mock_conf
-
-    mock_conf_manager.ConfManager.return_value = mock_cfm
+    _install_account_stanza({"account_id": "", "license_key": "secret_key"})
 
     with pytest.raises(ValueError, match="credentials not configured"):
         _get_account_credentials("session_key")
@@ -342,15 +293,7 @@ def test_get_account_credentials_raises_when_missing_account_id() -> None:
 
 def test_get_account_credentials_raises_when_missing_license_key() -> None:
     """Test _get_account_credentials raises ValueError when license_key missing."""
-    mock_stanza = {"account_id": "12345", "license_key": ""}
-
-    mock_conf = MagicMock()
-    mock_conf.get.return_value = mock_stanza
-
-    mock_cfm = MagicMock()
-    mock_cfm.get_conf.return_value = mock_conf
-
-    mock_conf_manager.ConfManager.return_value = mock_cfm
+    _install_account_stanza({"account_id": "12345", "license_key": ""})
 
     with pytest.raises(ValueError, match="credentials not configured"):
         _get_account_credentials("session_key")
@@ -358,15 +301,7 @@ def test_get_account_credentials_raises_when_missing_license_key() -> None:
 
 def test_get_account_credentials_raises_when_account_id_not_numeric() -> None:
     """Test _get_account_credentials raises ValueError for non-numeric account ID."""
-    mock_stanza = {"account_id": "abc", "license_key": "secret_key"}
-
-    mock_conf = MagicMock()
-    mock_conf.get.return_value = mock_stanza
-
-    mock_cfm = MagicMock()
-    mock_cfm.get_conf.return_value = mock_conf
-
-    mock_conf_manager.ConfManager.return_value = mock_cfm
+    _install_account_stanza({"account_id": "abc", "license_key": "secret_key"})
 
     with pytest.raises(ValueError, match="account ID must be a number"):
         _get_account_credentials("session_key")
@@ -374,13 +309,7 @@ def test_get_account_credentials_raises_when_account_id_not_numeric() -> None:
 
 def test_get_account_credentials_raises_when_conf_missing() -> None:
     """Test _get_account_credentials raises ValueError on fresh install."""
-    mock_conf = MagicMock()
-    mock_conf.get.side_effect = ConfStanzaNotExistException("account")
-
-    mock_cfm = MagicMock()
-    mock_cfm.get_conf.return_value = mock_conf
-
-    mock_conf_manager.ConfManager.return_value = mock_cfm
+    _install_account_stanza(ConfStanzaNotExistException("account"))
 
     with pytest.raises(ValueError, match="credentials not configured"):
         _get_account_credentials("session_key")
@@ -388,16 +317,7 @@ def test_get_account_credentials_raises_when_conf_missing() -> None:
 
 def test_get_database_names_returns_database_list() -> None:
     """Test _get_database_names returns list of database names."""
-    mock_conf = MagicMock()
-    mock_conf.get_all.return_value = {
-        "GeoLite2-Country": {},
-        "GeoLite2-City": {},
-    }
-
-    mock_cfm = MagicMock()
-    mock_cfm.get_conf.return_value = mock_conf
-
-    mock_conf_manager.ConfManager.return_value = mock_cfm
+    _install_database_stanzas({"GeoLite2-Country": {}, "GeoLite2-City": {}})
 
     databases = _get_database_names("session_key")
 
@@ -406,16 +326,7 @@ def test_get_database_names_returns_database_list() -> None:
 
 def test_get_database_names_excludes_default_stanza() -> None:
     """Test _get_database_names filters out the 'default' stanza."""
-    mock_conf = MagicMock()
-    mock_conf.get_all.return_value = {
-        "default": {},
-        "GeoLite2-Country": {},
-    }
-
-    mock_cfm = MagicMock()
-    mock_cfm.get_conf.return_value = mock_conf
-
-    mock_conf_manager.ConfManager.return_value = mock_cfm
+    _install_database_stanzas({"default": {}, "GeoLite2-Country": {}})
 
     databases = _get_database_names("session_key")
 
@@ -424,13 +335,7 @@ def test_get_database_names_excludes_default_stanza() -> None:
 
 def test_get_database_names_raises_when_empty() -> None:
     """Test _get_database_names raises ValueError when no databases configured."""
-    mock_conf = MagicMock()
-    mock_conf.get_all.return_value = {}
-
-    mock_cfm = MagicMock()
-    mock_cfm.get_conf.return_value = mock_conf
-
-    mock_conf_manager.ConfManager.return_value = mock_cfm
+    _install_database_stanzas({})
 
     with pytest.raises(ValueError, match="No databases configured"):
         _get_database_names("session_key")
@@ -438,13 +343,7 @@ def test_get_database_names_raises_when_empty() -> None:
 
 def test_get_database_names_raises_when_only_default() -> None:
     """Test _get_database_names raises ValueError when only default stanza exists."""
-    mock_conf = MagicMock()
-    mock_conf.get_all.return_value = {"default": {}}
-
-    mock_cfm = MagicMock()
-    mock_cfm.get_conf.return_value = mock_conf
-
-    mock_conf_manager.ConfManager.return_value = mock_cfm
+    _install_database_stanzas({"default": {}})
 
     with pytest.raises(ValueError, match="No databases configured"):
         _get_database_names("session_key")
@@ -452,87 +351,87 @@ def test_get_database_names_raises_when_only_default() -> None:
 
 def test_get_database_names_raises_when_conf_missing() -> None:
     """Test _get_database_names raises ValueError on fresh install."""
-    mock_cfm = MagicMock()
-    mock_cfm.get_conf.side_effect = ConfManagerException("Config file not found")
-
-    mock_conf_manager.ConfManager.return_value = mock_cfm
+    _install_database_stanzas(ConfManagerException("Config file not found"))
 
     with pytest.raises(ValueError, match="No databases configured"):
         _get_database_names("session_key")
 
 
-def test_run_update_logs_updated_databases(tmp_path: Path) -> None:
+def test_run_update_logs_updated_databases(
+    tmp_path: Path,
+    logger: _RecordingLogger,
+    monkeypatch: MonkeyPatch,
+) -> None:
     """Test _run_update logs info for updated databases."""
-    mock_logger = MagicMock(spec=logging.Logger)
-
-    mock_result = MagicMock()
-    mock_result.edition_id = "GeoLite2-Country"
-    mock_result.was_updated = True
-    mock_result.old_hash = "abc123"
-    mock_result.new_hash = "def456"
-
-    mock_updater = MagicMock()
-    mock_updater.run = AsyncMock(return_value=[mock_result])
-    mock_updater.__aenter__ = AsyncMock(return_value=mock_updater)
-    mock_updater.__aexit__ = AsyncMock(return_value=None)
-
-    with patch("geoipupdate_input.Updater", return_value=mock_updater):
-        _run_update(
-            account_id=TEST_ACCOUNT_ID,
-            license_key="key",
-            edition_ids=["GeoLite2-Country"],
-            database_directory=tmp_path,
-            logger=mock_logger,
-        )
+    mock_result = SimpleNamespace(
+        edition_id="GeoLite2-Country",
+        was_updated=True,
+        old_hash="abc123",
+        new_hash="def456",
+    )
 
-    # Check starting message
-    mock_logger.info.assert_any_call(
-        "Starting database update for editions: %s",
-        "GeoLite2-Country",
+    monkeypatch.setattr(
+        "geoipupdate_input.Updater",
+        lambda _config: _FakeUpdater([mock_result]),
     )
 
-    # Check updated message
-    mock_logger.info.assert_any_call(
-        "Updated %s: %s -> %s",
-        "GeoLite2-Country",
-        "abc123",
-        "def456",
+    _run_update(
+        account_id=TEST_ACCOUNT_ID,
+        license_key="key",
+        edition_ids=["GeoLite2-Country"],
+        database_directory=tmp_path,
+        logger=cast("logging.Logger", logger),
     )
 
+    # Check starting message
+    assert (
+        "info",
+        ("Starting database update for editions: %s", "GeoLite2-Country"),
+    ) in logger.records
+
+    # Check updated message
+    assert (
+        "info",
+        ("Updated %s: %s -> %s", "GeoLite2-Country", "abc123", "def456"),
+    ) in logger.records
+
 
-def test_run_update_logs_up_to_date_databases(tmp_path: Path) -> None:
+def test_run_update_logs_up_to_date_databases(
+    tmp_path: Path,
+    logger: _RecordingLogger,
+    monkeypatch: MonkeyPatch,
+) -> None:
     """Test _run_update logs info for databases already up to date."""
-    mock_logger = MagicMock(spec=logging.Logger)
-
-    mock_result = MagicMock()
-    mock_result.edition_id = "GeoLite2-Country"
-    mock_result.was_updated = False
-    mock_result.new_hash = "abc123"
-
-    mock_updater = MagicMock()
-    mock_updater.run = AsyncMock(return_value=[mock_result])
-    mock_updater.__aenter__ = AsyncMock(return_value=mock_updater)
-    mock_updater.__aexit__ = AsyncMock(return_value=None)
-
-    with patch("geoipupdate_input.Updater", return_value=mock_updater):
-        _run_update(
-            account_id=TEST_ACCOUNT_ID,
-            license_key="key",
-            edition_ids=["GeoLite2-Country"],
-            database_directory=tmp_path,
-            logger=mock_logger,
-        )
-
-    mock_logger.info.assert_any_call(
-        "%s is up to date (hash: %s)",
-        "GeoLite2-Country",
-        "abc123",
+    mock_result = SimpleNamespace(
+        edition_id="GeoLite2-Country",
+        was_updated=False,
+        new_hash="abc123",
     )
 
+    monkeypatch.setattr(
+        "geoipupdate_input.Updater",
+        lambda _config: _FakeUpdater([mock_result]),
+    )
+
+    _run_update(
+        account_id=TEST_ACCOUNT_ID,
+        license_key="key",
+        edition_ids=["GeoLite2-Country"],
+        database_directory=tmp_path,
+        logger=cast("logging.Logger", logger),
+    )
+
+    assert (
+        "info",
+        ("%s is up to date (hash: %s)", "GeoLite2-Country", "abc123"),
+    ) in logger.records
 
+
+@pytest.mark.usefixtures("stub_update")
 def test_stream_events_full_flow_downloads_database(
     httpserver: HTTPServer,
-    tmp_path: Path,
+    db_dir: Path,
+    logger: _RecordingLogger,
     monkeypatch: MonkeyPatch,
 ) -> None:
     """Integration test: stream_events downloads a database via HTTP.
@@ -541,11 +440,8 @@ def test_stream_events_full_flow_downloads_database(
     downloading and writing a database file, using a mock HTTP server instead
     of mocking the Updater.
     """
-    monkeypatch.setenv("MAXMIND_DB_DIR", str(tmp_path))
-
     edition_id = "GeoLite2-Country"
     mmdb_data = _create_test_mmdb()
-    mmdb_md5 = hashlib.md5(mmdb_data).hexdigest()  # noqa: S324
     tar_gz_data = _create_tar_gz(mmdb_data, edition_id)
 
     # Set up metadata endpoint
@@ -558,7 +454,7 @@ def test_stream_events_full_flow_downloads_database(
                 {
                     "edition_id": edition_id,
                     "date": "2024-01-01",
-                    "md5": mmdb_md5,
+                    "md5": TEST_MMDB_MD5,
                 }
             ]
         }
@@ -569,44 +465,29 @@ def test_stream_events_full_flow_downloads_database(
         f"/geoip/databases/{edition_id}/download",
     ).respond_with_data(
         tar_gz_data,
-        content_type="application/gzip",
-        headers={"Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"},
+        content_type=TEST_DOWNLOAD_CONTENT_TYPE,
+        headers=TEST_DOWNLOAD_HEADERS,
     )
 
-    input_obj = GeoIPUpdateInput()
-
-    inputs = MagicMock()
-    inputs.metadata = {"session_key": "test_session_key"}
-
-    mock_logger = MagicMock(spec=logging.Logger)
-
-    with (
-        patch("geoipupdate_input.get_logger", return_value=mock_logger),
-        patch(
-            "geoipupdate_input._get_account_credentials",
-            return_value=(TEST_ACCOUNT_ID, "test_key"),
-        ),
-        patch(
-            "geoipupdate_input._get_database_names",
-            return_value=[edition_id],
+    # Run the real update, with the host in the Config pointing to our test
+    # server
+    monkeypatch.setattr("geoipupdate_input._run_update", _run_update)
+    monkeypatch.setattr(
+        "geoipupdate_input.Config",
+        lambda **kwargs: PyGeoIPUpdateConfig(
+            **{**kwargs, "host": httpserver.url_for("/")}
         ),
-        # Override the host in the Config to point to our test server
-        patch(
-            "geoipupdate_input.Config",
-            lambda **kwargs: PyGeoIPUpdateConfig(
-                **{**kwargs, "host": httpserver.url_for("/")}
-            ),
-        ),
-    ):
-        input_obj.stream_events(inputs, None)
+    )
+
+    MODULAR_INPUT.stream_events(TEST_INPUTS, None)
 
     # Verify the database file was actually written
-    db_file = tmp_path / f"{edition_id}.mmdb"
+    db_file = db_dir / f"{edition_id}.mmdb"
     assert db_file.exists(), "Database file should have been created"
     assert db_file.read_bytes() == mmdb_data, "Database content should match"
 
     # Verify success was logged
-    mock_logger.info.assert_any_call("Database update completed successfully")
+    assert ("info", ("Database update completed successfully",)) in logger.records
 
 
 # --- Utility functions for creating test data ---
@@ -639,8 +520,8 @@ def _create_tar_gz(mmdb_data: bytes, edition_id: str) -> bytes:
         The tar.gz archive as bytes.
 
     """
-    tar_buffer = io.BytesIO()
-    with tarfile.open(fileobj=tar_buffer, mode="w") as tar:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
         # Add directory entry
         dir_info = tarfile.TarInfo(name=f"{edition_id}_20240101")
         dir_info.type = tarfile.DIRTYPE
@@ -651,9 +532,4 @@ def _create_tar_gz(mmdb_data: bytes, edition_id: str) -> bytes:
         file_info.size = len(mmdb_data)
         tar.addfile(file_info, io.BytesIO(mmdb_data))
 
-    tar_buffer.seek(0)
-    gz_buffer = io.BytesIO()
-    with gzip.GzipFile(fileobj=gz_buffer, mode="wb") as gz:
-        gz.write(tar_buffer.read())
-
-    return gz_buffer.getvalue()
+    return buffer.getvalue()